@@ -1,191 +1,211 @@
-import re
+import os
 import textwrap
 from pathlib import Path
 
-from more_itertools import peekable
-
 from mmd.parse import Document, Line, Modifier, Aside, Block, List, Paragraph, Section, parse
 
+# Heading tags by section level and by document nesting for titles
+_H_LEVELS = {1: 'h5', 2: 'h4', 3: 'h3', 4: 'h2'}
+_TITLE_LEVELS = {0: 'h2', 1: 'h4', 2: 'h5'}
+_LIST_TAGS = {
+    List.Kind.ALPHA: ('<ol type="A">', '</ol>'),
+    List.Kind.NUMERIC: ('<ol type="1">', '</ol>'),
+    List.Kind.ROMAN: ('<ol type="I">', '</ol>'),
+    List.Kind.DASH: ('<ul>', '</ul>'),
+}
+
+# Dedented once here, the rendered fragments are joined straight into the body.
+_PAGE = textwrap.dedent(
+    """
+    <!doctype html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+        <title>mmd</title>
+        <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/@picocss/pico@2/css/pico.min.css">
+        <style>
+            section {{ margin-left: 1rem }}
+            section > :where(h1, h2, h3, h4, h5, h6) {{ margin-left: -1rem }}
+        </style>
+    </head>
+    <body>
+    <main class="container">
+    {body}
+    </main>
+    </body>
+    </html>
+    """
+)
+
 
 def as_html(root: Document) -> str:
+    _Q, _B, _I, _M, _S, _ST = (
+        Modifier.QUOTES, Modifier.BOLD, Modifier.ITALIC, Modifier.MONOSPACE, Modifier.SELECT, Modifier.STRIKETHROUGH
+    )
+
     def l_as_html(l: Line):
-        output = ''
+        parts = []
 
-        def as_tag(s, modifier, start, end):
-            nonlocal output
+        def as_tag(parts, s, modifier, start, end):
             if s & modifier:
-                output += start
+                parts.append(start)
             else:
-                output += end
-
-        def all_tags(diff):
-            if diff & Modifier.QUOTES:
-                as_tag(w.modifier, Modifier.QUOTES, '<q>', '</q>')
-            if diff & Modifier.BOLD:
-                as_tag(w.modifier, Modifier.BOLD, '<strong>', '</strong>')
-            if diff & Modifier.ITALIC:
-                as_tag(w.modifier, Modifier.ITALIC, '<i>', '</i>')
-            if diff & Modifier.MONOSPACE:
-                as_tag(w.modifier, Modifier.MONOSPACE, '<code>', '</code>')
-            if diff & Modifier.SELECT:
-                as_tag(w.modifier, Modifier.SELECT, '<mark>', '</mark>')
-            if diff & Modifier.STRIKETHROUGH:
-                as_tag(w.modifier, Modifier.STRIKETHROUGH, '<s>', '</s>')
+                parts.append(end)
+
+        def all_tags(parts, s, diff):
+            if diff & _Q:
+                as_tag(parts, s, _Q, '<q>', '</q>')
+            if diff & _B:
+                as_tag(parts, s, _B, '<strong>', '</strong>')
+            if diff & _I:
+                as_tag(parts, s, _I, '<i>', '</i>')
+            if diff & _M:
+                as_tag(parts, s, _M, '<code>', '</code>')
+            if diff & _S:
+                as_tag(parts, s, _S, '<mark>', '</mark>')
+            if diff & _ST:
+                as_tag(parts, s, _ST, '<s>', '</s>')
 
         for src in l.content:
             prev = Modifier.NONE
             for w in src.content:
-                all_tags(prev ^ w.modifier)
+                all_tags(parts, w.modifier, prev ^ w.modifier)
                 prev = w.modifier
-                output += w.value
-            all_tags(prev)
-            output += ' '
+                parts.append(w.value)
+            all_tags(parts, prev, prev)
+            parts.append(' ')
+
+        return ''.join(parts).rstrip() + '<br>'
+
+    # Rendering walks an explicit stack of (handler, node, nesting) tasks instead of recursing,
+    #  handlers emit their opening tags and schedule their children followed by the closing work.
+    out = []
+    stack = []
 
-        return output.rstrip() + '<br>'
+    def schedule(*tasks):
+        stack.extend(reversed(tasks))
+
+    def emit(s: str, _nesting: int):
+        out.append(s)
+
+    def line_as_html(l: Line, _nesting: int):
+        out.append(l_as_html(l))
 
     def aside_as_html(a: Aside, nesting: int):
         # TODO: use kind
-        yield "<p>"
-        yield "<article>"
-        inner = d_as_html(a.document, nesting + 1)
+        out.append("<p>")
+        out.append("<article>")
+        schedule((d_as_html, a.document, nesting + 1), (aside_end, len(out), nesting))
+
+    def aside_end(first: int, _nesting: int):
+        inner = out[first:]
+        del out[first:]
 
         # If there is a title output, wrap in header and skip hr.
-        tmp = next(inner)
-        if tmp == '<hgroup>':
-            yield '<header>'
-            yield tmp
-            while (tmp := next(inner)) != '<hr>':
-                yield tmp
-            yield '</header>'
+        i = 1
+        if inner[0] == '<hgroup>':
+            out.append('<header>')
+            out.append(inner[0])
+            while inner[i] != '<hr>':
+                out.append(inner[i])
+                i += 1
+            out.append('</header>')
+            i += 1
 
         # If the first thing is a paragraph skip the tag as it messes with pico.css
-        tmp = next(inner)
-        if tmp != '<p>':
-            yield tmp
+        if inner[i] != '<p>':
+            out.append(inner[i])
 
-        yield from inner
-        yield "</article>"
+        out.extend(inner[i + 1:])
+        out.append("</article>")
 
     def block_as_html(b: Block, _nesting: int):
-        def inner():
-            yield "<pre><code>"
-            yield textwrap.dedent(''.join(x.content[0].value + '\n' for x in b.content)).replace('\n', '<br>')
-            yield "</code></pre>"
-
-        yield ''.join(inner())
+        # Same as textwrap.dedent, but joined with breaks in the same pass.
+        lines = [x.content[0].value for x in b.content]
+        margin = len(os.path.commonprefix([s[:len(s) - len(s.lstrip(' \t'))] for s in lines if s.strip(' \t')]))
+        out.append(
+            "<pre><code>"
+            + ''.join((s[margin:] if s.strip(' \t') else '') + '<br>' for s in lines)
+            + "</code></pre>"
+        )
 
     def list_as_html(ls: list[List], nesting: int):
-        start, end = None, None
-        if re.search(r'[A-Z]+\.\s*$', ls[0].marker):
-            start, end = '<ol type="A">', '</ol>'
-
-        if re.search(r'\d+\.\s*$', ls[0].marker):
-            start, end = '<ol type="1">', '</ol>'
-
-        if re.search(r'[IVXCM]+\.\s*$', ls[0].marker):
-            start, end = '<ol type="I">', '</ol>'
-
-        if re.search(r'\s*-\s*$', ls[0].marker):
-            start, end = '<ul>', '</ul>'
-
-        assert start is not None, repr(ls[0].marker)
-        assert end is not None, repr(ls[0].marker)
-
-        yield start
+        start, end = _LIST_TAGS[ls[0].kind]
+        out.append(start)
+        tasks = []
         for l in ls:
-            yield '<li>'
-            yield from d_as_html(l.document, nesting + 1)
-            yield '</li>'
-        yield end
+            tasks.append((emit, '<li>', nesting))
+            tasks.append((d_as_html, l.document, nesting + 1))
+            tasks.append((emit, '</li>', nesting))
+        tasks.append((emit, end, nesting))
+        schedule(*tasks)
 
     def p_as_html(p: Paragraph, nesting: int):
-        yield '<p>'
-        content = peekable(enumerate(p.content))
-        for i, x in content:
-            if isinstance(x, Line):
-                l = l_as_html(x)
-                if i + 1 == len(p.content):
-                    l = l.removesuffix('<br>')
-                yield l
-            if isinstance(x, Aside):
-                yield from aside_as_html(x, nesting)
-            if isinstance(x, Block):
-                yield from block_as_html(x, nesting)
-            if isinstance(x, List):
-                items = [x]
-                try:
-                    while isinstance(content.peek()[1], List):
-                        items.append(next(content)[1])
-                except StopIteration:
-                    pass
-
-                yield from list_as_html(items, nesting)
-        yield '</p>'
+        out.append('<p>')
+        tasks = []
+        content = p.content
+        n = len(content)
+        i = 0
+        while i < n:
+            x = content[i]
+            if type(x) is List:
+                # Glue consecutive lists together
+                j = i + 1
+                while j < n and type(content[j]) is List:
+                    j += 1
+
+                tasks.append((list_as_html, content[i:j], nesting))
+                i = j
+                continue
+
+            if (handler := p_dispatch.get(type(x))) is not None:
+                tasks.append((handler, x, nesting))
+            i += 1
+        tasks.append((p_end, p, nesting))
+        schedule(*tasks)
+
+    def p_end(p: Paragraph, _nesting: int):
+        # The last line of a paragraph does not need a break
+        if len(p.content) > 0 and type(p.content[-1]) is Line:
+            out[-1] = out[-1].removesuffix('<br>')
+        out.append('</p>')
 
     def s_as_html(s: Section, nesting: int):
-        yield '<section>'
-        yield {
-            1: f'<h5>{s.title}</h5>',
-            2: f'<h4>{s.title}</h4>',
-            3: f'<h3>{s.title}</h3>',
-            4: f'<h2>{s.title}</h2>',
-        }[min(max(1, s.level), 4)]
-        yield from d_as_html(s.document, nesting + 1)
-        yield '</section>'
+        out.append('<section>')
+        tag = _H_LEVELS[min(max(1, s.level), 4)]
+        out.append(f'<{tag}>{s.title}</{tag}>')
+        schedule((d_as_html, s.document, nesting + 1), (emit, '</section>', nesting))
 
     def d_as_html(d: Document, nesting: int):
-        def inner():
-            if d.title is not None:
-                yield '<hgroup>'
-                if isinstance(d.title, Paragraph):
-                    if len(d.title.content) > 0:
-                        start, end = {
-                            0: ('<h2>', '</h2>'),
-                            1: ('<h4>', '</h4>'),
-                            2: ('<h5>', '</h5>'),
-                        }[min(nesting, 2)]
-                        yield f'{start}{l_as_html(d.title.content[0]).removesuffix('<br>')}{end}'
-                    yield '<p>'
-                    for x in d.title.content[1:]:
-                        if isinstance(x, Line):
-                            yield l_as_html(x)
-                        else:
-                            print('Non-lines as title are not supported. And should not be allowed anyway.')
-                else:
-                    print('Section as title is not supported. And should not be allowed anyway.')
-                yield '</hgroup>'
-                yield '<hr>'
-
-            for x in d.content:
-                if isinstance(x, Section):
-                    yield from s_as_html(x, nesting)
-                if isinstance(x, Paragraph):
-                    yield from p_as_html(x, nesting)
-
-        yield from inner()
-
-    return textwrap.dedent(
-        f"""
-        <!doctype html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <title>mmd</title>
-            <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/@picocss/pico@2/css/pico.min.css">
-            <style>
-                section {{ margin-left: 1rem }}
-                section > :where(h1, h2, h3, h4, h5, h6) {{ margin-left: -1rem }}
-            </style>
-        </head>
-        <body>
-        <main class="container">
-{''.join(f'        {x}\n' for x in d_as_html(root, 0))}
-        </main>
-        </body>
-        </html>
-        """
-    )
+        if d.title is not None:
+            out.append('<hgroup>')
+            if isinstance(d.title, Paragraph):
+                if len(d.title.content) > 0:
+                    tag = _TITLE_LEVELS[min(nesting, 2)]
+                    out.append(f'<{tag}>{l_as_html(d.title.content[0]).removesuffix('<br>')}</{tag}>')
+                out.append('<p>')
+                for x in d.title.content[1:]:
+                    if isinstance(x, Line):
+                        out.append(l_as_html(x))
+                    else:
+                        print('Non-lines as title are not supported. And should not be allowed anyway.')
+            else:
+                print('Section as title is not supported. And should not be allowed anyway.')
+            out.append('</hgroup>')
+            out.append('<hr>')
+
+        schedule(*[(handler, x, nesting) for x in d.content if (handler := d_dispatch.get(type(x))) is not None])
+
+    p_dispatch = {Line: line_as_html, Aside: aside_as_html, Block: block_as_html}
+    d_dispatch = {Section: s_as_html, Paragraph: p_as_html}
+
+    schedule((d_as_html, root, 0))
+    while stack:
+        handler, x, nesting = stack.pop()
+        handler(x, nesting)
+
+    return _PAGE.format(body='\n'.join(out) + '\n')
 
 
 def command_html(file: Path, open: bool = False):
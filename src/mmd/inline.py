@@ -1,15 +1,39 @@
-import urllib
+import hashlib
+import os
+import urllib.request
 from pathlib import Path
 
+_PICO_URL = 'https://cdn.jsdelivr.net/npm/@picocss/pico@2/css/pico.min.css'
+
+
+def _cache_dir() -> Path:
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'mmd'
+
+
+def _fetch_cached(url: str) -> str:
+    """ Download url once and reuse the copy in the user cache afterward """
+    cached = _cache_dir() / hashlib.sha1(url.encode()).hexdigest()
+    if cached.is_file():
+        return cached.read_text(encoding='utf-8')
+
+    with urllib.request.urlopen(url, timeout=10) as response:
+        content = response.read()
+
+    # Write next to the target and swap it in, so a partial download is never reused.
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    partial = cached.with_name(f'{cached.name}.{os.getpid()}.tmp')
+    partial.write_bytes(content)
+    os.replace(partial, cached)
+    return content.decode('utf-8')
+
 
 def command_inline(file: Path):
     """ Inline CSS into the HTML for most previews to just work """
-    pico, _ = urllib.request.urlretrieve('https://cdn.jsdelivr.net/npm/@picocss/pico@2/css/pico.min.css')
-    pico = Path(pico).read_text()
+    pico = _fetch_cached(_PICO_URL)
 
     text = file.resolve(strict=True).read_text()
     replaced = text.replace(
-        '<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/@picocss/pico@2/css/pico.min.css">',
+        f'<link rel="stylesheet" href="{_PICO_URL}">',
         '<style>' + pico + '</style>'
     )
     (file := file.with_suffix('.local.html')).write_text(replaced)
@@ -2,10 +2,18 @@ import re
 from dataclasses import field, dataclass
 from enum import Flag, auto, StrEnum
 from pathlib import Path
-from typing import Optional
+from string import ascii_uppercase
+from typing import Optional, TextIO
 
+_RE_LEAD_WS = re.compile(r'^(\s*)')
+_RE_HEADING = re.compile(r'^(#+)(\s*)(?:\s(.+)\s*)?$')
+_RE_BLOCK_OPEN = re.compile(r'^```(.+)?\s*$')
+_RE_ASIDE = re.compile(r'^(([_#]?)>\s*)')
+_RE_LIST = re.compile(r'^((?:[A-Z]+\.|\d+\.|[IVXCM]+\.|\s*-)+(?:\s+|$))')
+_RE_TOKEN = re.compile(r'[_*~`]{1,2}|["\[\]]|\s+|[^_*~`"\[\]\s]+')
 
-@dataclass
+
+@dataclass(slots=True)
 class SourceReference:
     file: Path
     lineno: int
@@ -30,7 +38,18 @@ class Modifier(Flag):
     BLOCK = auto()
 
 
-@dataclass
+_INLINE_MOD_MAP: dict[str, Modifier] = {
+    '*': Modifier.BOLD,
+    '_': Modifier.ITALIC,
+    '~': Modifier.STRIKETHROUGH,
+    '`': Modifier.MONOSPACE,
+    '"': Modifier.QUOTES,
+    '[': Modifier.SELECT,
+    ']': Modifier.SELECT,
+}
+
+
+@dataclass(slots=True)
 class Word:
     value: str
     modifier: Modifier
@@ -42,13 +61,13 @@ class Word:
             return f'Word(value={self.value!r}, {self.modifier.name!s})'
 
 
-@dataclass
+@dataclass(slots=True)
 class SourceLine:
     reference: SourceReference
     content: list[Word] = field(default_factory=lambda: [])
 
 
-@dataclass
+@dataclass(slots=True)
 class Line:
     content: list[SourceLine] = field(default_factory=lambda: [])
 
@@ -63,7 +82,7 @@ class Line:
         self.content.append(src)
 
 
-@dataclass
+@dataclass(slots=True)
 class Aside:
     class Kind(StrEnum):
         PLAIN = ''
@@ -78,17 +97,45 @@ class Aside:
         return self.document.paragraph.line
 
 
-@dataclass
+@dataclass(slots=True)
 class List:
+    class Kind(StrEnum):
+        ALPHA = 'A'
+        NUMERIC = '1'
+        ROMAN = 'I'
+        DASH = '-'
+
+        @classmethod
+        def of(cls, marker: str) -> 'List.Kind':
+            """ Classify by the character before the final dot, e.g. `II.1.` numbers as `1.` """
+            marker = marker.rstrip()
+            if marker.endswith('-'):
+                return cls.DASH
+
+            if marker.endswith('.'):
+                last = marker[-2:-1]
+                if last.isdecimal():
+                    return cls.NUMERIC
+                if last and last in 'IVXCM':
+                    return cls.ROMAN
+                if last and last in ascii_uppercase:
+                    return cls.ALPHA
+
+            raise ValueError(f'Unknown list marker {marker!r}')
+
     marker: str
     document: 'Document'
+    kind: Kind = field(init=False)
+
+    def __post_init__(self):
+        self.kind = List.Kind.of(self.marker)
 
     @property
     def line(self) -> Optional[Line]:
         return self.document.paragraph.line
 
 
-@dataclass
+@dataclass(slots=True)
 class Block:
     language: Optional[str]
     content: list[SourceLine] = field(default_factory=lambda: [])
@@ -98,7 +145,7 @@ class Block:
         return None
 
 
-@dataclass
+@dataclass(slots=True)
 class Paragraph:
     content: list[Line | Aside | List | Block] = field(default_factory=lambda: [])
 
@@ -117,7 +164,7 @@ class Paragraph:
         self.content.append(line)
 
 
-@dataclass
+@dataclass(slots=True)
 class Section:
     level: int
     title: SourceLine
@@ -128,7 +175,7 @@ class Section:
         return self.document.paragraph
 
 
-@dataclass
+@dataclass(slots=True)
 class Document:
     indent: int
     title: Optional[Paragraph] = field(default=None)
@@ -148,175 +195,181 @@ class Document:
         return self.content.pop()
 
 
+def _read_lines(f: TextIO):
+    """ Lazily yield the lines of f without their line endings """
+    for line in f:
+        yield from line.splitlines()
+
+
 def parse(file: Path) -> Document:
-    stack = [Document(0)]
+    _NONE, _WITH_SPACES, _ALIGN, _BLOCK, _QUOTES = (
+        Modifier.NONE, Modifier.WITH_SPACES, Modifier.ALIGN, Modifier.BLOCK, Modifier.QUOTES
+    )
 
-    def indent() -> int:
-        nonlocal stack
-        return sum(d.indent for d in stack)
+    stack = [Document(0)]
+    # Kept in sync with the stack to avoid summing it on every use.
+    indent_total = 0
 
     def document() -> Document:
         nonlocal stack
         return stack[-1]
 
-    lines = file.read_text().splitlines()
-    lines_iterator = enumerate(lines)
-
-    for lineno, text in lines_iterator:
-        reference = SourceReference(file, lineno + 1)
-
-        try:
-            # Pop document if indent is no longer matched
-            #  (empty lines should not pop as spaces get stripped by editors).
-            while len(stack) > 1 and len(text) > 0 and not re.match(r'^\s*$', text[:indent()]):
-                previous = stack.pop()
-
-                # Remove empty paragraph if it exists and it was not the default one.
-                if not previous.empty() and previous.paragraph.empty():
-                    # Re-add the paragraph in the correct document instead
-                    # if re.match(r'^\s*$', lines[lineno - 1]):
-                    document().append(previous.pop())
-
-            # Remove the indent
-            text = text[indent():]
-
-            # Claim space if still empty
-            if document().empty():
-                if match := re.match(r'^(\s*)', text):
-                    remaining, = match.groups()
-                    remaining = len(remaining)
-                    if remaining > 0 and len(stack) == 1:
-                        raise ValueError(f'Invalid space on root document @ {reference}')
-
-                    document().indent += remaining
-                    text = text[remaining:]
-
-            # Mark as title with triple
-            if re.match(r'^---', text):
-                document().title = document().pop()
-                document().append(Paragraph())
-                continue
-
-            # New section if it starts with hashtags
-            #   Title is optional handled afterward
-            if match := re.match(r'^(#+)(\s*)(?:\s(.+)\s*)?$', text):
-                # Remove empty paragraph if it exists
-                if document().paragraph.empty():
-                    document().pop()
-
-                level, pad, title = match.groups()
-                level, pad = len(level), len(pad)
-                virtual_document = Document(level + pad + 1)
-                document().append(Section(level, title, virtual_document))
-                stack.append(virtual_document)
-                continue
-
-            # Block
-            if match := re.match(r'^```(.+)?\s*$', text):
-                language, = match.groups()
-
-                block = Block(language)
-
-                # Skip the current line
-                lineno, text = next(lines_iterator)
-
-                # Match all until next delimiter
-                while not re.match(r'^```\s*$', text[indent():]):
-                    block.content.append(
-                        SourceLine(reference=SourceReference(file, lineno),
-                                   content=[Word(text[indent():], Modifier.BLOCK)])
-                    )
-                    lineno, text = next(lines_iterator)
-
-                # Push the block
-                document().paragraph.append(block)
-                continue
-
-            # Aside if it starts with `.?>`
-            if match := re.match(r'^(([_#]?)>\s*)', text):
-                match, kind = match.groups()
-
-                virtual_document = Document(len(match))
-                document().paragraph.append(Aside(Aside.Kind(kind), virtual_document))
-                stack.append(virtual_document)
-
-                # Clean up text and continue parsing this source line
-                text = text[len(match):]
-
-            # List (known only implemented)
-            if match := re.match(r'^((?:[A-Z]+\.|\d+\.|[IVXCM]+\.|\s*-)+(?:\s+|$))', text):
-                marker, = match.groups()
-
-                virtual_document = Document(len(marker))
-                document().paragraph.append(List(marker, virtual_document))
-                stack.append(virtual_document)
-
-                # Clean up text and continue parsing this source line
-                text = text[len(marker):]
-
-            # New paragraph if whitespace only or empty
-            if re.match(r'^\s*$', text):
-
-                # Skip if paragraph is empty
-                if document().paragraph.empty():
+    with file.open('r', encoding='utf-8') as f:
+        lines_iterator = enumerate(_read_lines(f))
+
+        for lineno, line in lines_iterator:
+            text = line
+            reference = SourceReference(file, lineno + 1)
+
+            try:
+                # Pop document if indent is no longer matched
+                #  (empty lines should not pop as spaces get stripped by editors).
+                while len(stack) > 1 and len(text) > 0 and text[:indent_total].strip():
+                    indent_total -= stack[-1].indent
+                    previous = stack.pop()
+
+                    # Remove empty paragraph if it exists and it was not the default one.
+                    if not previous.empty() and previous.paragraph.empty():
+                        # Re-add the paragraph in the correct document instead
+                        # if the previous source line was blank:
+                        document().append(previous.pop())
+
+                # Remove the indent
+                text = text[indent_total:]
+
+                # Claim space if still empty
+                if document().empty():
+                    if match := _RE_LEAD_WS.match(text):
+                        remaining, = match.groups()
+                        remaining = len(remaining)
+                        if remaining > 0 and len(stack) == 1:
+                            raise ValueError(f'Invalid space on root document @ {reference}')
+
+                        document().indent += remaining
+                        indent_total += remaining
+                        text = text[remaining:]
+
+                # Mark as title with triple
+                if text.startswith('---'):
+                    document().title = document().pop()
+                    document().append(Paragraph())
                     continue
 
-                document().append(Paragraph())
-                continue
+                # New section if it starts with hashtags
+                #   Title is optional handled afterward
+                if match := _RE_HEADING.match(text):
+                    # Remove empty paragraph if it exists
+                    if document().paragraph.empty():
+                        document().pop()
+
+                    level, pad, title = match.groups()
+                    level, pad = len(level), len(pad)
+                    virtual_document = Document(level + pad + 1)
+                    document().append(Section(level, title, virtual_document))
+                    stack.append(virtual_document)
+                    indent_total += virtual_document.indent
+                    continue
+
+                # Block
+                if match := _RE_BLOCK_OPEN.match(text):
+                    language, = match.groups()
 
-            # New line if it does not start with a space
-            if re.match(r'^\S', text):
-                document().paragraph.append(Line())
+                    block = Block(language)
 
-            # Continued line otherwise
-            else:
-                if document().paragraph.empty():
-                    raise ValueError(f"Invalid indentation @ {reference}")
+                    # Skip the current line
+                    lineno, line = next(lines_iterator)
 
-                text = f'{text.lstrip()}'
+                    # Match all until next delimiter
+                    while True:
+                        body = line[indent_total:]
+                        if body.rstrip() == '```':
+                            break
 
-            ## Text/Word level parsing
-            source_line = SourceLine(reference)
-            words = re.split(r'([_*~`]{1,2}|["\[\]]|\s+)', text.rstrip())
+                        block.content.append(
+                            SourceLine(reference=SourceReference(file, lineno),
+                                       content=[Word(body, _BLOCK)])
+                        )
+                        lineno, line = next(lines_iterator)
 
-            modifier = Modifier.NONE
-            for i in range(len(words)):
-                if len(words[i]) == 0:
+                    # Push the block
+                    document().paragraph.append(block)
                     continue
 
-                # TODO: If it is a space then it coudl be aligning something.
-
-                mapping = {
-                    '*': Modifier.BOLD,
-                    '_': Modifier.ITALIC,
-                    '~': Modifier.STRIKETHROUGH,
-                    '`': Modifier.MONOSPACE,
-                    '"': Modifier.QUOTES,
-                    '[': Modifier.SELECT,
-                    ']': Modifier.SELECT,
-                }
-
-                if words[i][0] in mapping:
-                    applied = mapping[words[i][0]]
-                    if len(words[i]) == 2 or applied == Modifier.QUOTES:
-                        applied |= modifier.WITH_SPACES
-                    modifier ^= applied
+                # Aside if it starts with `.?>`
+                if match := _RE_ASIDE.match(text):
+                    match, kind = match.groups()
+
+                    virtual_document = Document(len(match))
+                    document().paragraph.append(Aside(Aside.Kind(kind), virtual_document))
+                    stack.append(virtual_document)
+                    indent_total += virtual_document.indent
+
+                    # Clean up text and continue parsing this source line
+                    text = text[len(match):]
+
+                # List (known only implemented)
+                if match := _RE_LIST.match(text):
+                    marker, = match.groups()
+
+                    virtual_document = Document(len(marker))
+                    document().paragraph.append(List(marker, virtual_document))
+                    stack.append(virtual_document)
+                    indent_total += virtual_document.indent
+
+                    # Clean up text and continue parsing this source line
+                    text = text[len(marker):]
+
+                # New paragraph if whitespace only or empty
+                if not text or text.isspace():
+
+                    # Skip if paragraph is empty
+                    if document().paragraph.empty():
+                        continue
+
+                    document().append(Paragraph())
                     continue
 
-                if modifier != Modifier.NONE and not (modifier & Modifier.WITH_SPACES) and re.match(r'\s', words[i]):
-                    raise ValueError(f'Spaces are not allowed here! @ {reference}')
+                # New line if it does not start with a space
+                if text[:1] and not text[:1].isspace():
+                    document().paragraph.append(Line())
+
+                # Continued line otherwise
+                else:
+                    if document().paragraph.empty():
+                        raise ValueError(f"Invalid indentation @ {reference}")
+
+                    text = f'{text.lstrip()}'
+
+                ## Text/Word level parsing
+                source_line = SourceLine(reference)
+
+                modifier = _NONE
+                for token in _RE_TOKEN.finditer(text.rstrip()):
+                    w = token.group()
+
+                    # TODO: If it is a space then it coudl be aligning something.
+
+                    applied = _INLINE_MOD_MAP.get(w[0])
+                    if applied is not None:
+                        if len(w) == 2 or applied == _QUOTES:
+                            applied |= _WITH_SPACES
+                        modifier ^= applied
+                        continue
+
+                    if modifier != _NONE and not (modifier & _WITH_SPACES) and w[:1].isspace():
+                        raise ValueError(f'Spaces are not allowed here! @ {reference}')
 
-                source_line.content.append(Word(words[i], modifier))
+                    source_line.content.append(Word(w, modifier))
 
-                # Remove ALIGN after one word and check line before.
-                if modifier & Modifier.ALIGN:
-                    modifier ^= Modifier.ALIGN
+                    # Remove ALIGN after one word and check line before.
+                    if modifier & _ALIGN:
+                        modifier ^= _ALIGN
 
-            document().paragraph.line.append(source_line)
+                document().paragraph.line.append(source_line)
 
-        except Exception as e:
-            e.add_note(f"@ {reference!s}, {indent():2} = {lines[lineno][indent()]!r}")
-            raise e
+            except Exception as e:
+                e.add_note(f"@ {reference!s}, {indent_total:2} = {line[indent_total]!r}")
+                raise e
 
     return stack[0]
 